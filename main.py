@@ -1,11 +1,14 @@
 import os
 import asyncio
+import collections
+import contextlib
+import functools
 import logging
-import json
+import socket
+import sys
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from google import genai
-from google.genai.types import LiveConnectConfig, PrebuiltVoiceConfig, VoiceConfig
 
 # --- CONFIGURATION ---
 API_KEY = os.environ.get("GEMINI_API_KEY")
@@ -15,12 +18,124 @@ if not API_KEY:
 # Use the latest model ID from your docs
 MODEL_ID = "	gemini-2.5-flash-native-audio-preview-12-2025" 
 
+# Hard cap on a single bridged session (seconds). Dead TCP peers are reaped
+# earlier by the server's WebSocket ping (see Procfile); this bounds sessions
+# that stay technically alive but are never closed.
+SESSION_TIMEOUT = float(os.environ.get("SESSION_TIMEOUT", 600))
+
+# Max concurrently bridged sessions per worker. Enforced in the WebSocket
+# handler rather than with uvicorn's --limit-concurrency, which never rejects
+# WebSocket upgrades but does count them, so at the limit it would 503 plain
+# HTTP requests, including the health check.
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 1000))
+active_sessions = 0
+
+# Max client audio chunks buffered before we stop reading from the client.
+# The client sends 512 samples (32 ms @ 16 kHz), so 32 chunks is ~1 s of audio.
+UPSTREAM_QUEUE_SIZE = 32
+
+# Audio is re-chunked into fixed 20 ms frames before going to Gemini
+# (16 kHz * 2 bytes * 0.02 s = 640 bytes), so each session.send carries a
+# predictable amount of audio regardless of the client's chunk size.
+UPSTREAM_FRAME_BYTES = 640
+
+# Optional SO_BUSY_POLL budget (microseconds) for client sockets. Busy polling
+# trades CPU for lower receive latency; 0 leaves it off. Values above the
+# net.core.busy_read sysctl need CAP_NET_ADMIN. Linux only.
+BUSY_POLL_USEC = int(os.environ.get("BUSY_POLL_USEC", 0))
+SO_BUSY_POLL = getattr(socket, "SO_BUSY_POLL", 46)
+
+# Max Gemini audio chunks buffered on the way to the client. Past this the
+# oldest chunk is dropped, so a slow client hears a glitch instead of lagging.
+DOWNSTREAM_QUEUE_SIZE = 50
+
+# Upper bound for one coalesced audio frame to the client. Only audio that is
+# already queued gets merged, so a backlog is flushed in a few larger frames.
+DOWNSTREAM_MAX_FRAME_BYTES = 16384
+
+# High-water mark for the client socket's write buffer. The asyncio default
+# (64 KiB) is easily hit by bursts of 24 kHz output audio, which makes every
+# send wait on drain. Trusted bridge clients can afford 1 MiB each.
+WRITE_BUFFER_HIGH = 1 << 20
+
+# Audio is only handed to the socket while less than this much is still
+# unsent. Beyond it, audio stays in our own buffer, where drop-oldest applies
+# and control frames can go first, instead of queueing behind up to
+# WRITE_BUFFER_HIGH (~20 s of audio) in the transport.
+CLIENT_BACKLOG_BYTES = 64 * 1024
+
+# How often (seconds) a backlogged sender rechecks the socket
+CLIENT_BACKLOG_POLL = 0.02
+
+# Text frames from the client must start with this exact prefix to be parsed
+TEXT_INPUT_PREFIX = '{"type":"text_input"'
+
+# Everything sent to the client is a binary frame whose first byte is an opcode:
+#   0x00 audio (raw PCM follows)   0x01 text (UTF-8 follows)
+#   0x02 turn complete             0x03 interrupted
+# so the client dispatches on one byte and nothing is JSON-encoded.
+OP_AUDIO = b"\x00"
+TURN_COMPLETE_FRAME = b"\x02"
+INTERRUPTED_FRAME = b"\x03"
+
+# --- GEMINI (lazy) ---
+# google-genai pulls in a large dependency tree, so it is imported in a worker
+# thread right after startup (see lifespan below) instead of at module load.
+# The health check never waits for it, which keeps cold starts fast on
+# autoscaled platforms (Railway, Hugging Face).
+
+@functools.cache
+def get_client():
+    """
+    Gemini Client shared by all connections (using v1alpha as per advanced
+    docs for best features). Each live.connect opens its own session, so one
+    client is enough for any number of concurrent bridges.
+    """
+    from google import genai
+    return genai.Client(api_key=API_KEY, http_options={"api_version": "v1alpha"})
+
+@functools.cache
+def get_live_config():
+    """
+    Live Session config, built once and shared by every connection.
+    We ask for AUDIO response and set a specific voice.
+    """
+    from google.genai.types import LiveConnectConfig, PrebuiltVoiceConfig, SpeechConfig, VoiceConfig
+    return LiveConnectConfig(
+        response_modalities=["AUDIO"],
+        speech_config=SpeechConfig(
+            voice_config=VoiceConfig(
+                prebuilt_voice_config=PrebuiltVoiceConfig(voice_name="Puck")
+            )
+        ),
+    )
+
 # --- LOGGING SETUP ---
-logging.basicConfig(level=logging.INFO)
+# Defaults to WARNING so per-connection/per-turn chatter stays off in
+# production; set LOG_LEVEL=INFO (or DEBUG) to see it.
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
 logger = logging.getLogger("GeminiBridge")
 
 # --- APP SETUP ---
-app = FastAPI()
+
+def warm_gemini():
+    """Import the SDK and build the shared client/config. Runs in a thread."""
+    get_client()
+    get_live_config()
+
+def log_warmup_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("🔥 Failed to load Gemini SDK: %s", task.exception())
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the Gemini cache off the event loop. Health checks are served right
+    # away; WebSocket connections wait on this task before touching the SDK.
+    app.state.gemini_ready = asyncio.create_task(asyncio.to_thread(warm_gemini))
+    app.state.gemini_ready.add_done_callback(log_warmup_failure)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # 1. GLOBAL CORS FIX (Crucial for Hugging Face)
 app.add_middleware(
@@ -31,6 +146,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- HELPERS ---
+
+def find_transport(websocket: WebSocket):
+    """
+    Best-effort lookup of the asyncio transport behind a Starlette WebSocket.
+    The ASGI send callable is a bound method of the server protocol (uvicorn),
+    possibly wrapped in middleware closures, so we unwrap until we find it.
+    """
+    stack, seen = [websocket._send], set()
+    while stack:
+        fn = stack.pop()
+        if id(fn) in seen:
+            continue
+        seen.add(id(fn))
+        transport = getattr(getattr(fn, "__self__", None), "transport", None)
+        if transport is not None:
+            return transport
+        for cell in getattr(fn, "__closure__", None) or ():
+            try:
+                contents = cell.cell_contents
+            except ValueError:
+                continue
+            if callable(contents):
+                stack.append(contents)
+    return None
+
+def tune_client_socket(websocket: WebSocket):
+    """
+    Apply write-buffer and latency socket options to an accepted client.
+    Returns the transport (or None) so callers can watch its write backlog.
+    """
+    transport = find_transport(websocket)
+    if transport is None:
+        return None
+
+    # Raise the write buffer so audio bursts don't stall on drain
+    transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+
+    sock = transport.get_extra_info("socket")
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return transport
+    try:
+        # Never let Nagle hold back small audio/control frames
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if BUSY_POLL_USEC and sys.platform == "linux":
+            sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, BUSY_POLL_USEC)
+    except OSError as e:
+        logger.warning("⚠️ Could not tune client socket: %s", e)
+    return transport
+
 # --- ROUTES ---
 
 @app.get("/")
@@ -44,48 +209,159 @@ async def websocket_endpoint(websocket: WebSocket):
     Bi-directional Bridge:
     Client (Hugging Face) <-> Railway <-> Gemini Live API
     """
+    global active_sessions
+
     await websocket.accept()
-    logger.info("🔌 Client Connected via WebSocket")
+    logger.debug("🔌 Client Connected via WebSocket")
 
-    # Initialize Gemini Client (using v1alpha as per advanced docs for best features)
-    client = genai.Client(api_key=API_KEY, http_options={"api_version": "v1alpha"})
+    # Refuse sessions past the cap with 1013 (Try Again Later)
+    if active_sessions >= MAX_SESSIONS:
+        logger.warning("🚫 Session limit (%d) reached, refusing connection", MAX_SESSIONS)
+        await websocket.close(code=1013)
+        return
+    active_sessions += 1
 
-    # Configure the Live Session
-    # We ask for AUDIO response and set a specific voice.
-    config = {
-        "response_modalities": ["AUDIO"],
-        "speech_config": {
-            "voice_config": PrebuiltVoiceConfig(voice_name="Puck")
-        }
-    }
+    transport = tune_client_socket(websocket)
 
     try:
+        # Make sure the SDK import finished off the event loop. The warm-up
+        # task is shared, so shield it from this handler being cancelled;
+        # without lifespan (--lifespan off) warm up here, still off the loop.
+        gemini_ready = getattr(app.state, "gemini_ready", None)
+        if gemini_ready is not None:
+            await asyncio.shield(gemini_ready)
+        else:
+            await asyncio.to_thread(warm_gemini)
+
         # Connect to Gemini Live
-        async with client.aio.live.connect(model=MODEL_ID, config=config) as session:
-            logger.info(f"✨ Connected to Gemini Live ({MODEL_ID})")
+        async with get_client().aio.live.connect(model=MODEL_ID, config=get_live_config()) as session:
+            logger.info("✨ Connected to Gemini Live (%s)", MODEL_ID)
 
-            # --- TASK A: Receive Audio from Client -> Send to Gemini ---
+            # Bounded buffer between the client socket and Gemini. When Gemini
+            # stalls the queue fills up and the receive loop blocks, which
+            # back-pressures the client instead of piling up in OS buffers.
+            upstream_queue = asyncio.Queue(maxsize=UPSTREAM_QUEUE_SIZE)
+
+            # --- TASK A: Receive Audio/Text from Client -> Queue ---
             async def receive_from_client():
+                # Bound once; this loop runs for every audio frame
+                receive = websocket.receive
+                blocked_puts = 0
                 try:
                     while True:
-                        # 1. Receive raw PCM bytes from Hugging Face
-                        data = await websocket.receive_bytes()
-                        if not data:
-                            break
-                        
-                        # 2. Send to Gemini
-                        # We send "end_of_turn=False" to let Gemini's VAD decide when to reply
-                        await session.send(
-                            input={"data": data, "mime_type": "audio/pcm"}, 
-                            end_of_turn=False 
-                        )
+                        # 1. Receive raw PCM bytes (or a text control frame) from Hugging Face
+                        message = await receive()
+
+                        # Audio is the hot path, so check it first with a single lookup
+                        data = message.get("bytes")
+                        if data is not None:
+                            if not data:
+                                break
+                        else:
+                            text = message.get("text")
+                            if text is None:
+                                if message["type"] == "websocket.disconnect":
+                                    raise WebSocketDisconnect(message.get("code", 1000))
+                                continue
+                            # Only {"type":"text_input", "text": ...} is accepted; anything
+                            # else is dropped without paying for a JSON parse.
+                            if not text.startswith(TEXT_INPUT_PREFIX):
+                                continue
+                            try:
+                                payload = orjson.loads(text)
+                            except orjson.JSONDecodeError:
+                                continue
+                            # Anything but a non-empty string would corrupt the
+                            # audio carry buffer downstream, so drop it
+                            data = payload.get("text") if isinstance(payload, dict) else None
+                            if not data or not isinstance(data, str):
+                                continue
+
+                        # 2. Hand off to the Gemini forwarder. Puts that block on a
+                        # full queue are counted and reported once the stall clears.
+                        if upstream_queue.full():
+                            blocked_puts += 1
+                        elif blocked_puts:
+                            logger.warning("⏳ Gemini fell behind, %d client chunks waited on a full queue", blocked_puts)
+                            blocked_puts = 0
+                        await upstream_queue.put(data)
                 except WebSocketDisconnect:
-                    logger.info("⚠️ Client Disconnected (Receive Loop)")
+                    logger.debug("⚠️ Client Disconnected (Receive Loop)")
                 except Exception as e:
-                    logger.error(f"❌ Error receiving from client: {e}")
+                    logger.error("❌ Error receiving from client: %s", e)
 
-            # --- TASK B: Receive Audio from Gemini -> Send to Client ---
-            async def send_to_client():
+            # --- TASK A2: Queue -> Send to Gemini ---
+            async def forward_to_gemini():
+                # Carry buffer for audio that doesn't fill a whole frame yet
+                pending = bytearray()
+                try:
+                    while True:
+                        data = await upstream_queue.get()
+                        if isinstance(data, str):
+                            # Typed text completes the user's turn
+                            await session.send(input=data, end_of_turn=True)
+                            continue
+
+                        pending.extend(data)
+                        usable = len(pending) - len(pending) % UPSTREAM_FRAME_BYTES
+                        if not usable:
+                            continue
+
+                        # Slice frames through a memoryview so each frame is
+                        # copied exactly once (the SDK only accepts bytes), then
+                        # trim the carry buffer once per chunk instead of per frame.
+                        with memoryview(pending) as view:
+                            for start in range(0, usable, UPSTREAM_FRAME_BYTES):
+                                # We send "end_of_turn=False" to let Gemini's VAD decide when to reply
+                                await session.send(
+                                    input={"data": bytes(view[start:start + UPSTREAM_FRAME_BYTES]), "mime_type": "audio/pcm"},
+                                    end_of_turn=False
+                                )
+                        del pending[:usable]
+                except Exception as e:
+                    logger.error("❌ Error sending to Gemini: %s", e)
+
+            # Gemini -> client buffer, in arrival order. Items are audio chunks
+            # (bytes) or None, which marks a turn_complete. Audio is lossy: when
+            # the client falls behind, the oldest audio chunk is dropped, but
+            # turn_complete markers are never evicted and stay behind their
+            # audio. Only an interruption jumps the queue (it clears the audio).
+            downstream = collections.deque()
+            downstream_ready = asyncio.Event()
+            queued_audio = 0
+            dropped_audio = 0
+            interrupted = False
+
+            def queue_audio(data):
+                nonlocal queued_audio, dropped_audio
+                if queued_audio >= DOWNSTREAM_QUEUE_SIZE:
+                    # Evict the oldest audio chunk, skipping turn_complete markers
+                    for i, item in enumerate(downstream):
+                        if item is not None:
+                            del downstream[i]
+                            break
+                    queued_audio -= 1
+                    dropped_audio += 1
+                downstream.append(data)
+                queued_audio += 1
+                downstream_ready.set()
+
+            def queue_turn_complete():
+                downstream.append(None)
+                downstream_ready.set()
+
+            def queue_interrupted():
+                nonlocal queued_audio, interrupted
+                # Queued audio is stale now; keep only the turn_complete markers
+                markers = downstream.count(None)
+                downstream.clear()
+                downstream.extend([None] * markers)
+                queued_audio = 0
+                interrupted = True
+                downstream_ready.set()
+
+            # --- TASK B: Receive Audio from Gemini -> Buffer ---
+            async def receive_from_gemini():
                 try:
                     while True:
                         # 1. Iterate through the session generator
@@ -99,31 +375,105 @@ async def websocket_endpoint(websocket: WebSocket):
                                 for part in server_content.model_turn.parts:
                                     # Check for inline_data (Audio bytes)
                                     if part.inline_data and part.inline_data.data:
-                                        # Send raw audio bytes back to Hugging Face
-                                        await websocket.send_bytes(part.inline_data.data)
+                                        queue_audio(part.inline_data.data)
 
                             # 3. Handle Interruption (User spoke while model was talking)
                             if server_content.interrupted:
-                                logger.info("🛑 Gemini was interrupted by user")
-                                # Optional: Send a text flag to client to clear audio buffer
-                                # await websocket.send_text("INTERRUPTED")
+                                logger.debug("🛑 Gemini was interrupted by user")
+                                # Drop our stale audio and tell the client to clear
+                                # its own buffer too
+                                queue_interrupted()
 
                             # 4. Handle Turn Complete
                             if server_content.turn_complete:
-                                logger.info("✅ Gemini Turn Complete")
+                                logger.debug("✅ Gemini Turn Complete")
+                                queue_turn_complete()
                 except Exception as e:
-                    logger.error(f"❌ Error receiving from Gemini: {e}")
+                    logger.error("❌ Error receiving from Gemini: %s", e)
+
+            # --- TASK B2: Buffer -> Send to Client ---
+            async def send_to_client():
+                nonlocal queued_audio, dropped_audio, interrupted
+                # Reused ASGI message for every frame; the server reads it
+                # before send() returns, so one dict per session is enough.
+                frame_message = {"type": "websocket.send", "bytes": b""}
+                try:
+                    while True:
+                        await downstream_ready.wait()
+                        downstream_ready.clear()
+
+                        while True:
+                            if interrupted:
+                                interrupted = False
+                                frame_message["bytes"] = INTERRUPTED_FRAME
+                                await websocket.send(frame_message)
+                            if not downstream:
+                                break
+
+                            if downstream[0] is None:
+                                downstream.popleft()
+                                frame_message["bytes"] = TURN_COMPLETE_FRAME
+                                await websocket.send(frame_message)
+                                continue
+
+                            # Client is behind: leave audio in our buffer so
+                            # drop-oldest applies and interruptions can still
+                            # go out first, and check the socket again shortly
+                            if transport is not None and transport.get_write_buffer_size() > CLIENT_BACKLOG_BYTES:
+                                await asyncio.sleep(CLIENT_BACKLOG_POLL)
+                                continue
+
+                            data = downstream.popleft()
+
+                            # Coalesce audio that is already waiting into one frame,
+                            # stopping at a turn_complete so it stays in order.
+                            # We never wait for more, so this adds no latency.
+                            chunks = [OP_AUDIO, data]
+                            size = len(data)
+                            while size < DOWNSTREAM_MAX_FRAME_BYTES and downstream and downstream[0] is not None:
+                                data = downstream.popleft()
+                                chunks.append(data)
+                                size += len(data)
+                            queued_audio -= len(chunks) - 1
+
+                            # Send opcode + raw audio bytes back to Hugging Face.
+                            # The join copies even a single chunk: SDK chunks are
+                            # immutable bytes and ASGI sends one buffer per
+                            # message, so the opcode can't be prepended in place.
+                            frame_message["bytes"] = b"".join(chunks)
+                            await websocket.send(frame_message)
+
+                        # Caught up; report any overload once per burst
+                        if dropped_audio:
+                            logger.warning("⏳ Client fell behind, dropped %d audio chunks", dropped_audio)
+                            dropped_audio = 0
+                except Exception as e:
+                    logger.error("❌ Error sending to client: %s", e)
 
             # --- RUN LOOPS CONCURRENTLY ---
             # Using wait allows us to stop if either side disconnects
-            await asyncio.wait(
-                [asyncio.create_task(receive_from_client()), 
-                 asyncio.create_task(send_to_client())],
-                return_when=asyncio.FIRST_COMPLETED
-            )
+            tasks = [asyncio.create_task(receive_from_client()),
+                     asyncio.create_task(forward_to_gemini()),
+                     asyncio.create_task(receive_from_gemini()),
+                     asyncio.create_task(send_to_client())]
+            try:
+                done, pending = await asyncio.wait(
+                    tasks,
+                    return_when=asyncio.FIRST_COMPLETED,
+                    timeout=SESSION_TIMEOUT,
+                )
+                if not done:
+                    logger.info("⌛ Session hit the %ss limit, closing", SESSION_TIMEOUT)
+            finally:
+                # Cancel the other tasks so they don't keep running against a
+                # dead socket (and holding the Gemini session open). This also
+                # runs if the handler itself is cancelled, e.g. at shutdown.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
 
     except Exception as e:
-        logger.error(f"🔥 Bridge Error: {e}")
+        logger.error("🔥 Bridge Error: %s", e)
         # Try to send error to client if still connected
         try:
             await websocket.send_text(f"Error: {str(e)}")
@@ -131,4 +481,5 @@ async def websocket_endpoint(websocket: WebSocket):
         except:
             pass
     finally:
-        logger.info("👋 Connection Closed")
+        active_sessions -= 1
+        logger.debug("👋 Connection Closed")
@@ -1,4 +1,5 @@
 import asyncio
+import threading
 import websockets
 import pyaudio
 import json
@@ -13,27 +14,61 @@ CHANNELS = 1
 RATE_IN = 16000  # Mic input
 RATE_OUT = 24000 # Gemini output (usually 24k)
 CHUNK = 512
+SAMPLE_WIDTH = 2  # bytes per paInt16 sample
+
+# Opcodes for binary frames from the bridge
+OP_AUDIO = 0x00
+OP_TEXT = 0x01
+OP_TURN_COMPLETE = 0x02
+OP_INTERRUPTED = 0x03
 
 async def run_client():
     p = pyaudio.PyAudio()
-    
+    loop = asyncio.get_running_loop()
+
+    # Mic audio arrives on PortAudio's thread and is handed to the event loop,
+    # so the loop never blocks on a read
+    mic_queue = asyncio.Queue()
+
+    def mic_callback(in_data, frame_count, time_info, status):
+        loop.call_soon_threadsafe(mic_queue.put_nowait, in_data)
+        return (None, pyaudio.paContinue)
+
+    # Received audio is appended to a buffer that PortAudio's thread drains;
+    # when it runs dry we play silence instead of blocking
+    playback = bytearray()
+    playback_lock = threading.Lock()
+
+    def speaker_callback(in_data, frame_count, time_info, status):
+        needed = frame_count * CHANNELS * SAMPLE_WIDTH
+        with playback_lock:
+            data = bytes(playback[:needed])
+            del playback[:needed]
+        if len(data) < needed:
+            data += b"\x00" * (needed - len(data))
+        return (data, pyaudio.paContinue)
+
     # Input Stream (Mic)
-    mic_stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE_IN, input=True, frames_per_buffer=CHUNK)
-    
+    mic_stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE_IN, input=True, frames_per_buffer=CHUNK,
+                        stream_callback=mic_callback, start=False)
+
     # Output Stream (Speaker)
-    speaker_stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE_OUT, output=True)
+    speaker_stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE_OUT, output=True,
+                            stream_callback=speaker_callback, start=False)
 
     print(f"Connecting to {URL}...")
     try:
-        async with websockets.connect(URL) as ws:
+        # PCM audio doesn't compress, so skip permessage-deflate entirely
+        async with websockets.connect(URL, compression=None) as ws:
             print("✅ Connected! Start speaking into your mic...")
+            mic_stream.start_stream()
+            speaker_stream.start_stream()
 
             async def send_audio():
                 while True:
                     try:
-                        data = mic_stream.read(CHUNK, exception_on_overflow=False)
+                        data = await mic_queue.get()
                         await ws.send(data)
-                        await asyncio.sleep(0.01)
                     except Exception as e:
                         print(f"Send Error: {e}")
                         break
@@ -42,11 +77,25 @@ async def run_client():
                 while True:
                     try:
                         response = await ws.recv()
-                        if isinstance(response, bytes):
-                            # Play audio directly
-                            speaker_stream.write(response)
-                        else:
+                        if not isinstance(response, bytes) or not response:
                             print(f"Text: {response}")
+                            continue
+
+                        # First byte is the opcode (see main.py)
+                        opcode = response[0]
+                        if opcode == OP_AUDIO:
+                            # Queue for playback
+                            with playback_lock:
+                                playback.extend(memoryview(response)[1:])
+                        elif opcode == OP_TEXT:
+                            print(f"Text: {response[1:].decode()}")
+                        elif opcode == OP_TURN_COMPLETE:
+                            print("Turn complete")
+                        elif opcode == OP_INTERRUPTED:
+                            # Drop audio the model no longer wants played
+                            with playback_lock:
+                                playback.clear()
+                            print("Interrupted")
                     except Exception as e:
                         print(f"Receive Error: {e}")
                         break